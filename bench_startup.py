@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+""" measure the startup time of the lightweight main.py commands
+
+    Builds small vehicles and Avis reports in a temporary directory (the Avis report has
+    no closed rentals sheet, so the missing sheet path is covered), warms the table cache, then
+    runs each command several times in a fresh interpreter and compares the median wall
+    clock time against a budget.  It also checks (with python's -X importtime) that the
+    command didn't import any of the slow modules, and that every run exited with the
+    expected status and without a traceback.  Exits non-zero if any check fails, so it
+    can be run after changes to main.py:
+
+        ./bench_startup.py [ --budget 0.5 ] [ --runs 5 ]
+
+    The scripts are copied into the temporary directory with the reports, with a .env that
+    points the Avis settings at the generated report; config.py already looks for the
+    vehicles report in the current directory.  A .env next to the real main.py isn't used.
+"""
+
+import os
+import sys
+import glob
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+import time
+
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# commands that should start quickly, and the exit statuses they may return
+COMMANDS = [
+        [ [ 'check' ], [ 0 ] ],
+        [ [ '--help' ], [ 0 ] ],
+        [ [ 'counts' ], [ 0 ] ],
+        [ [ 'dump', 'vehicles' ], [ 0 ] ],
+        [ [ 'dump', 'closed_rentals' ], [ 1 ] ],
+        ]
+
+# modules the lightweight commands must not import
+SLOW_MODULES = [ 'openpyxl' ]
+
+
+def make_fixture(bench_dir):
+    """ copy the scripts into bench_dir and write small reports next to them """
+    import openpyxl
+
+    for filename in glob.glob(os.path.join(SRC_DIR, '*.py')):
+        shutil.copy(filename, bench_dir)
+
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = 'Sheet1'
+    ws.append([ 'Ctg', 'Key', 'Rcvd From', 'Driver', 'Status', 'Reservation No', 'Plate' ])
+    for i in range(200):
+        ws.append([ 'R', '', f"Driver, { i }", f"Driver, { i }", 'Active', f"RES{ i }", f"PLATE{ i }" ])
+    wb.save(os.path.join(bench_dir, 'Vehicles.xlsx'))
+
+    # an Avis report with only the open rentals sheet
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = 'Open RA'
+    ws.append([ 'report' ])
+    ws.append([ 'date' ])
+    ws.append([ None, 'MVA No', 'License Plate Number', 'Reservation No', 'Cost Control No' ])
+    for i in range(50):
+        ws.append([ None, f"{ i }", f"PLATE{ i }", f"RES-{ i }", '534' ])
+    wb.save(os.path.join(bench_dir, 'open_rentals.xlsx'))
+
+    with open(os.path.join(bench_dir, '.env'), 'w') as f:
+        f.write("OPEN_RENTALS=./open_rentals.xlsx\n")
+        f.write("CLOSED_RENTALS=./open_rentals.xlsx\n")
+
+
+def run_command(bench_dir, command, expected, python_args=()):
+    """ run main.py once; returns its stderr, or None (after saying why) if the run failed """
+
+    result = subprocess.run([ sys.executable ] + list(python_args) + [ os.path.join(bench_dir, 'main.py') ] + command,
+            cwd=bench_dir, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+
+    if result.returncode not in expected:
+        print(f"{ ' '.join(command) }: exited with status { result.returncode }")
+        print(result.stderr)
+        return None
+
+    if 'Traceback (most recent call last)' in result.stderr:
+        print(f"{ ' '.join(command) }: printed a traceback")
+        print(result.stderr)
+        return None
+
+    return result.stderr
+
+
+def time_command(bench_dir, command, expected, runs):
+    """ return the median wall clock time in seconds to run main.py with command, or None if a run failed """
+
+    times = []
+    for i in range(runs):
+        start = time.perf_counter()
+        stderr = run_command(bench_dir, command, expected)
+        times.append(time.perf_counter() - start)
+        if stderr is None:
+            return None
+
+    return statistics.median(times)
+
+
+def imported_modules(bench_dir, command, expected):
+    """ return the names of the modules imported running main.py with command, or None if it failed """
+
+    stderr = run_command(bench_dir, command, expected, python_args=[ '-X', 'importtime' ])
+    if stderr is None:
+        return None
+
+    # lines look like: "import time:       123 |        456 | package.module"
+    modules = set()
+    for line in stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            modules.add(line.rsplit('|', 1)[1].strip())
+
+    return modules
+
+
+def main():
+    args = parse_args()
+
+    bench_dir = tempfile.mkdtemp(prefix='bench-startup-')
+    try:
+        failed = run_benchmark(bench_dir, args)
+    finally:
+        shutil.rmtree(bench_dir, ignore_errors=True)
+
+    sys.exit(1 if failed else 0)
+
+
+def run_benchmark(bench_dir, args):
+    """ returns true if any command failed or was over budget """
+
+    make_fixture(bench_dir)
+
+    # the first counts fills the table cache, so the timed runs measure the cached path
+    if run_command(bench_dir, [ 'counts' ], [ 0 ]) is None:
+        return True
+
+    failed = False
+    for command, expected in COMMANDS:
+        name = ' '.join(command)
+
+        median = time_command(bench_dir, command, expected, args.runs)
+        if median is None:
+            failed = True
+            continue
+
+        ok = median <= args.budget
+        print(f"{ name:<20} { median * 1000:8.1f} ms  { 'ok' if ok else 'OVER BUDGET' }")
+        if not ok:
+            failed = True
+
+        modules = imported_modules(bench_dir, command, expected)
+        if modules is None:
+            failed = True
+            continue
+
+        for slow in SLOW_MODULES:
+            if slow in modules:
+                print(f"{ name:<20} imported { slow }")
+                failed = True
+
+    return failed
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+            description="check the startup time of the lightweight main.py commands",
+            allow_abbrev=False)
+    parser.add_argument("--budget", help="allowed median time per command, in seconds", type=float, default=0.5)
+    parser.add_argument("--runs", help="number of times to run each command", type=int, default=5)
+
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    main()
@@ -16,6 +16,7 @@ OUTPROCESSED_ROSTER_TITLE_ROW = 6
 
 VEHICLES = f"{ SRC_DIR }/Vehicles.xlsx"
 VEHICLES_SHEET_NAME = "Sheet1"
+VEHICLES_TITLE_ROW = 1
 
 OPEN_RENTALS_DIR = f"{ HOME_DIR }/American Red Cross/NHQDCSDLC - FY21 Avis Report"
 #OPEN_RENTALS_DIR = SRC_DIR
@@ -32,6 +33,8 @@ CLOSED_RENTALS_TITLE_ROW = 4
 #DST_DIR = SRC_DIR
 DST_DIR = "."
 OUTPUT_WB = f"{ DST_DIR }/merged.xlsx"
+# parsed copies of the input tables used by the counts and dump commands
+CACHE_DIR = f"{ DST_DIR }/.cache"
 MERGED_SHEET_NAME = "No Veh Entry"
 RECONCILED_SHEET_NAME = "Reconciled"
 CURRENT_SHEET_NAME = "Current"
@@ -7,6 +7,8 @@ from logging.config import dictConfig
 def init_logging(app_name):
     logging_config = {
         'version': 1,
+        # this runs after the modules have created their loggers; keep them working
+        'disable_existing_loggers': False,
         'handlers': {
             'console': {
                 'class': 'logging.StreamHandler',
@@ -47,5 +49,3 @@ def init_logging(app_name):
     log = logging.getLogger(app_name)
     return log
 
-log = init_logging(__name__)
-
@@ -9,11 +9,8 @@ import datetime
 
 import init_logging
 
-import openpyxl
-import openpyxl.utils
-import openpyxl.styles
-import openpyxl.styles.colors
-import dotenv
+# openpyxl and dotenv are slow to import, so they are imported inside the functions that
+# use them; the lightweight commands (check, counts, dump) never need openpyxl at all.
 
 import config as config_static
 
@@ -41,35 +38,289 @@ def current_filter(row):
     return row['Ctg'] == 'R' and row['Status'] == 'Active'
 
 
+class InputError(Exception):
+    """ raised when the inputs needed to build the output workbook are missing """
+
+
+class MissingSheetError(InputError):
+    """ raised when an input file doesn't have the sheet config names for it """
+
+
+def load_config():
+    """ merge the static settings in config.py with any overrides from a .env file """
+    import dotenv
+
+    config_dotenv = dotenv.dotenv_values(verbose=True)
+
+    # all the settings in config.py are upper case names
+    config = AttrDict((key, val) for key, val in vars(config_static).items() if key.isupper())
+
+    #log.debug(f"config after copy: { config.keys() }")
+
+    for key, val in config_dotenv.items():
+        config[key] = val
+
+    return config
+
+
+def input_present(filename):
+    """ return true if an (optional) input file was configured and exists """
+    return filename is not None and os.path.exists(filename)
+
+
+# the input tables: config entries for the file, the sheet name and the title row
+TABLES = {
+        'vehicles': [ 'VEHICLES', 'VEHICLES_SHEET_NAME', 'VEHICLES_TITLE_ROW' ],
+        'staff_roster': [ 'STAFF_ROSTER', 'STAFF_ROSTER_SHEET_NAME', 'STAFF_ROSTER_TITLE_ROW' ],
+        'outprocessed_roster': [ 'OUTPROCESSED_ROSTER', 'OUTPROCESSED_ROSTER_SHEET_NAME', 'OUTPROCESSED_ROSTER_TITLE_ROW' ],
+        'open_rentals': [ 'OPEN_RENTALS', 'OPEN_RENTALS_SHEET_NAME', 'OPEN_RENTALS_TITLE_ROW' ],
+        'closed_rentals': [ 'CLOSED_RENTALS', 'CLOSED_RENTALS_SHEET_NAME', 'CLOSED_RENTALS_TITLE_ROW' ],
+        }
+
+
 def main():
     args = parse_args()
+    init_logging.init_logging(__name__)
     if args.debug:
         logging.getLogger().setLevel(logging.DEBUG)
     log.debug("running...")
 
-    config_dotenv = dotenv.dotenv_values(verbose=True)
+    config = load_config()
+
+    commands = {
+            'merge': command_merge,
+            'check': command_check,
+            'counts': command_counts,
+            'dump': command_dump,
+            }
+    status = commands[args.command](config, args)
+    sys.exit(status)
 
-    config = AttrDict()
-    for item in dir(config_static):
-        if not item.startswith('__'):
-            config[item] = getattr(config_static, item)
 
-    #log.debug(f"config after copy: { config.keys() }")
+def command_merge(config, args):
+    """ build the merged workbook (the default command) """
+    try:
+        make_workbook(config, config.OUTPUT_WB)
+    except InputError as e:
+        log.fatal(str(e))
+        return 1
+    return 0
 
-    for key, val in config_dotenv.items():
-        config[key] = val
+
+def command_check(config, args):
+    """ report which input files and sheets are present; fails if the vehicles table is missing """
+
+    status = 0
+    for name, (file_key, sheet_key, title_key) in TABLES.items():
+        filename = config[file_key]
+        sheet_name = config[sheet_key]
+
+        if not input_present(filename):
+            state = "missing"
+        else:
+            try:
+                names = sheet_names(filename)
+            except (OSError, KeyError, ValueError) as e:
+                log.debug(f"can't read sheet names from { filename }: { e }")
+                names = None
+
+            if names is None:
+                state = "unreadable"
+            elif sheet_name not in names:
+                state = f"missing sheet { sheet_name }"
+            else:
+                state = "ok"
+
+        print(f"{ name }\t{ state }\t{ filename }")
+        if name == 'vehicles' and state != "ok":
+            status = 1
+
+    return status
+
+
+def sheet_names(filename):
+    """ return the names of the sheets in an xlsx file
+
+        This reads the workbook's table of contents directly, so checking for a sheet
+        doesn't need openpyxl.
+    """
+    import zipfile
+    import xml.etree.ElementTree as ElementTree
+
+    with zipfile.ZipFile(filename) as z:
+        root = ElementTree.fromstring(z.read('xl/workbook.xml'))
+
+    # the tags are namespaced, and the namespace differs between xlsx flavors
+    return [ e.get('name') for e in root.iter() if e.tag == 'sheet' or e.tag.endswith('}sheet') ]
+
+
+def command_counts(config, args):
+    """ print the number of data rows in each input table that is present """
+
+    for name, (file_key, sheet_key, title_key) in TABLES.items():
+        if not input_present(config[file_key]):
+            print(f"{ name }\t-")
+            continue
+
+        try:
+            title, rows = read_table(config, name, use_cache=not args.no_cache)
+        except MissingSheetError:
+            print(f"{ name }\tmissing sheet")
+            continue
+
+        print(f"{ name }\t{ len(rows) }")
+
+    return 0
+
+
+def command_dump(config, args):
+    """ write one input table to stdout as tab separated values """
+    import csv
+
+    file_key = TABLES[args.table][0]
+    if not input_present(config[file_key]):
+        log.error(f"{ args.table } file { config[file_key] } not found")
+        return 1
+
+    try:
+        title, rows = read_table(config, args.table, use_cache=not args.no_cache)
+    except MissingSheetError as e:
+        log.error(str(e))
+        return 1
+
+    try:
+        writer = csv.writer(sys.stdout, dialect='excel-tab', lineterminator='\n')
+        writer.writerow(title)
+        for row in rows:
+            writer.writerow([ '' if value is None else value for value in row ])
+        sys.stdout.flush()
+    except BrokenPipeError:
+        # the reader stopped early (e.g. piped into head), which is fine.  Point stdout at
+        # devnull so python's final flush at exit doesn't fail on the closed pipe again.
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+
+    return 0
+
+
+def read_table(config, name, use_cache=True):
+    """ return the title row and the data rows (as lists of values) of one input table
+
+        The values are cached as json in config.CACHE_DIR, keyed by the input file's path,
+        size and modification time, so repeated runs over the same report don't need to
+        load openpyxl or parse the workbook.  Dates come back from the cache as strings.
+        Writing a new version of a table's cache removes the older versions.
+
+        Raises MissingSheetError if the file doesn't have the table's sheet; that is
+        cached too.
+    """
+    import json
+    import hashlib
+
+    file_key, sheet_key, title_key = TABLES[name]
+    filename = config[file_key]
+    sheet_name = config[sheet_key]
+    title_row = int(config[title_key])
+
+    st = os.stat(filename)
+    # cache files are named <table>-<version>.json: the table part names the file and sheet,
+    # the version part changes whenever the file does
+    table_key = f"{ os.path.realpath(filename) }|{ sheet_name }|{ title_row }"
+    version_key = f"{ st.st_size }|{ st.st_mtime_ns }"
+    cache_prefix = hashlib.sha256(table_key.encode('utf-8')).hexdigest()[:32] + '-'
+    cache_name = cache_prefix + hashlib.sha256(version_key.encode('utf-8')).hexdigest()[:16] + '.json'
+    cache_file = os.path.join(config.CACHE_DIR, cache_name)
+
+    if use_cache and os.path.exists(cache_file):
+        log.debug(f"reading { name } from cache { cache_file }")
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+    else:
+        cached = parse_table(filename, sheet_name, title_row)
+        if use_cache:
+            write_table_cache(config.CACHE_DIR, cache_prefix, cache_name, cached)
+
+    if cached.get('missing_sheet'):
+        raise MissingSheetError(f"{ name } file { filename } has no sheet { sheet_name }")
+
+    return cached['title'], cached['rows']
+
+
+def parse_table(filename, sheet_name, title_row):
+    """ read one sheet with openpyxl into the json-ready form read_table caches """
+    import json
+    import openpyxl
+
+    log.debug(f"reading sheet { sheet_name } from { filename }")
+    wb = openpyxl.load_workbook(filename, read_only=True)
+    if sheet_name not in wb.sheetnames:
+        wb.close()
+        return { 'source': filename, 'missing_sheet': True }
+
+    ws = wb[sheet_name]
+
+    title = None
+    rows = []
+    for row in ws.iter_rows(min_row=title_row, values_only=True):
+        if title is None:
+            title = list(row)
+            continue
+        rows.append(list(row))
+    wb.close()
+
+    if title is None:
+        title = []
+
+    # round trip through json so a cache miss gives back the same values a cache hit would
+    return json.loads(json.dumps({ 'source': filename, 'title': title, 'rows': rows }, default=str))
+
+
+def write_table_cache(cache_dir, cache_prefix, cache_name, cached):
+    """ write a read_table cache file, and drop the caches of older versions of the same table """
+    import json
+    import tempfile
+
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_file = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(cached, f)
+    os.replace(tmp_file, os.path.join(cache_dir, cache_name))
+
+    for entry in os.scandir(cache_dir):
+        if entry.name.startswith(cache_prefix) and entry.name.endswith('.json') and entry.name != cache_name:
+            log.debug(f"removing stale cache { entry.path }")
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                # another run got to it first
+                pass
+
+
+def make_workbook(config, output_file, load_workbook=None):
+    """ read the input reports named in config and write the merged workbook to output_file
+
+        load_workbook is called with an input filename and returns an openpyxl workbook.
+        The input workbooks' contents aren't changed, so a caller that builds many outputs
+        (the service) may hand back the same already-parsed workbook for identical files.
+        Reading a workbook still changes openpyxl's internal state, though, so the same
+        workbook must not be used by two calls at once.
+
+        Raises InputError if a required input is missing.
+    """
+    import openpyxl
+
+    if load_workbook is None:
+        load_workbook = openpyxl.load_workbook
 
     vehicles_file = config.VEHICLES
-    if not os.path.exists(vehicles_file):
-        log.fatal(f"Vehicles file { vehicles_file } not found")
-        sys.exit(1)
+    if not input_present(vehicles_file):
+        raise InputError(f"Vehicles file { vehicles_file } not found")
 
-    vehicles_wb = openpyxl.load_workbook(vehicles_file)
+    vehicles_wb = load_workbook(vehicles_file)
     vehicles_ws = vehicles_wb[config.VEHICLES_SHEET_NAME]
     vehicles_map = build_map(vehicles_ws, "Vehicles", 1, ["Rcvd From"], rentals_filter)
 
     # delete workbook if it exists
-    output_file = config.OUTPUT_WB
     if os.path.exists(output_file):
         # eventually copy fields out...
         os.remove(output_file)
@@ -82,12 +333,12 @@ def main():
     current_ws = None
     vehicles_spec = [ ['Name', 20 ], ['Reservation No', 15 ], [ 'GAP', 15 ], ['Date Received', 12 ] ]
     vehicles_spec_len = len(vehicles_spec)
-    if not os.path.exists(staff_file):
+    if not input_present(staff_file):
         log.info(f"skipping { config.MERGED_SHEET_NAME } sheet: could not find staff roster { staff_file }")
     else:
 
         log.debug(f"generating { config.MERGED_SHEET_NAME } sheet using { staff_file }")
-        staff_wb = openpyxl.load_workbook(staff_file)
+        staff_wb = load_workbook(staff_file)
         staff_ws = staff_wb[config.STAFF_ROSTER_SHEET_NAME]
         staff_map = build_map(staff_ws, "Staff Roster", config.STAFF_ROSTER_TITLE_ROW, ["Name"], empty_filter)
 
@@ -116,12 +367,12 @@ def main():
 
 
     outprocessed_file = config.OUTPROCESSED_ROSTER
-    if not os.path.exists(outprocessed_file):
+    if not input_present(outprocessed_file):
         log.info(f"skipping { config.OUTPROCESSED_SHEET_NAME } sheet: could not find outprocessed roster file { outprocessed_file }")
     else:
         log.debug(f"generating { config.OUTPROCESSED_SHEET_NAME } sheet using { outprocessed_file }")
 
-        outroster_wb = openpyxl.load_workbook(outprocessed_file)
+        outroster_wb = load_workbook(outprocessed_file)
         outroster_ws = outroster_wb[config.OUTPROCESSED_ROSTER_SHEET_NAME]
         outroster_map = build_map(outroster_ws, "Outprocessed Roster", config.OUTPROCESSED_ROSTER_TITLE_ROW, ["Name"], outprocessed_filter)
         #outroster_spec = [ [ 'Email', 30 ], [ 'Cell phone', 14 ], [ 'Checked in', 20 ], [ 'Released', 20 ], [ 'Supervisor(s)', 20 ] ]
@@ -142,11 +393,11 @@ def main():
     open_file = config.OPEN_RENTALS
     open_rentals_ws = None
     closed_rentals_ws = None
-    if not os.path.exists(open_file):
+    if not input_present(open_file):
         log.info(f"skipping { config.RECONCILED_SHEET_NAME } sheet: could not find avis file { open_file }")
     else:
         log.debug(f"generating { config.RECONCILED_SHEET_NAME } sheet using { open_file }")
-        rentals_wb = openpyxl.load_workbook(open_file, read_only=False)
+        rentals_wb = load_workbook(open_file)
         open_rentals_ws = rentals_wb[config.OPEN_RENTALS_SHEET_NAME]
         #open_rentals_ws.reset_dimensions()      # useful for read-only spreadsheets
 
@@ -157,8 +408,7 @@ def main():
 
     # if neither sheet was created: give an error
     if len(output_wb.sheetnames) == 1:
-        log.fatal(f"Neither the AVIS file ({ open_file }) nor the staff roster ({ staff_file }) were present.  Aborting...")
-        sys.exit(1)
+        raise InputError(f"Neither the AVIS file ({ open_file }) nor the staff roster ({ staff_file }) were present.  Aborting...")
 
     if current_ws is not None:
         annotate_vehicles_with_avis(current_ws, vehicles_spec_len, open_rentals_ws, config.OPEN_RENTALS_TITLE_ROW,
@@ -183,6 +433,7 @@ def make_merged(out_ws, vehicles_map, vehicles_spec, staff_map, staff_spec, supp
 
         suppress_missing means: don't output the line if there is no matching join in the staff_map
     """
+    import openpyxl.utils
 
     #log.debug(f"make_merged: vehicles_map size: { len(vehicles_map) }")
 
@@ -306,7 +557,9 @@ def filter_left_only(left, right):
 
 def make_reconciled(reconciled_ws, rentals_ws, rentals_starting_row, vehicles_ws, vehicles_starting_row, dr_list):
     """ generate reconciled ws from rentals_ws, marking which key numbers and reservation numbers are in vehicles_ws """
-    
+    import openpyxl.utils
+    import openpyxl.styles
+
     rentals_name_map, rentals_cols = process_title_row(rentals_ws, rentals_starting_row)
     vehicles_name_map, vehicles_cols = process_title_row(vehicles_ws, vehicles_starting_row)
 
@@ -549,6 +802,7 @@ def build_map(sheet, sheet_name, starting_row, key_name_list, row_filter):
 
 
 def annotate_vehicles_with_avis(current_ws, insert_col, open_ws, open_starting_row, closed_ws, closed_starting_row):
+    import openpyxl.utils
 
     current_ws.insert_cols(insert_col + 1)
     current_ws.cell(row=1, column=insert_col + 1, value="Avis")
@@ -579,6 +833,25 @@ def parse_args():
             description="process support for the regional bootcamp mission card system",
             allow_abbrev=False)
     parser.add_argument("--debug", help="turn on debugging output", action="store_true")
+    parser.set_defaults(command='merge')
+
+    # lets --debug come after the command too.  SUPPRESS keeps the command's parser from
+    # resetting a --debug given before the command back to False.
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--debug", help="turn on debugging output", action="store_true", default=argparse.SUPPRESS)
+
+    subparsers = parser.add_subparsers(title="commands", description="with no command the merged workbook is built")
+    subparsers.add_parser("merge", parents=[common], help="build the merged workbook").set_defaults(command='merge')
+    subparsers.add_parser("check", parents=[common], help="check that the input files exist").set_defaults(command='check')
+
+    counts_parser = subparsers.add_parser("counts", parents=[common], help="print the number of rows in each input table")
+    counts_parser.set_defaults(command='counts')
+    counts_parser.add_argument("--no-cache", help="read the input files even if a cached copy exists", action="store_true")
+
+    dump_parser = subparsers.add_parser("dump", parents=[common], help="dump an input table as tab separated values")
+    dump_parser.set_defaults(command='dump')
+    dump_parser.add_argument("table", choices=TABLES.keys(), help="which table to dump")
+    dump_parser.add_argument("--no-cache", help="read the input file even if a cached copy exists", action="store_true")
 
     #group = parser.add_mutually_exclusive_group(required=True)
     #group.add_argument("-p", "--prod", "--production", help="use production settings", action="store_true")
@@ -0,0 +1,593 @@
+#!/usr/bin/env python
+
+""" run the merge as a small local http service
+
+    Instead of everyone keeping their own copy of the tool and the reports, one copy
+    runs as a service and people submit jobs to it.  The api:
+
+        PUT  /files                 body is an .xlsx file; returns { "file": id }
+        POST /jobs                  body is json naming the inputs; returns { "job": id, ... }
+        GET  /jobs/<id>             job status
+        GET  /jobs/<id>/workbook    the merged workbook once the job is done
+        GET  /status                workbook cache statistics
+
+    A job names each input either by an uploaded file id or by a path relative to the
+    server's data directory (path inputs are refused unless --data-dir is given):
+
+        { "vehicles": { "file": "<id>" },
+          "staff_roster": { "path": "staff_roster.xlsx" },
+          "open_rentals": { "file": "<id>" } }
+
+    Only vehicles is required; a missing optional input means that tab isn't generated,
+    just like the command line tool.  outprocessed_roster defaults to staff_roster.
+
+    Jobs run on a fixed size pool of worker threads, and only a bounded number of jobs
+    may wait for a worker; past that new jobs are refused with a 503.  Parsed input
+    workbooks are kept in a cache keyed by file identity, so jobs that reuse the same
+    reports don't pay to parse them again (but do take turns using them).
+
+    Only the most recent finished jobs are kept; older ones are forgotten and their
+    workbooks deleted.  Uploads are deleted once no kept job uses them and they haven't
+    been uploaded again for a while.
+"""
+
+import os
+import re
+import json
+import uuid
+import shutil
+import hashlib
+import logging
+import argparse
+import tempfile
+import time
+import threading
+import contextlib
+import collections
+import concurrent.futures
+import http.server
+
+import init_logging
+
+import openpyxl
+
+import main as merge
+
+
+log = logging.getLogger(__name__)
+
+
+# job inputs, and the config entry each one overrides
+JOB_INPUTS = {
+        'vehicles': 'VEHICLES',
+        'staff_roster': 'STAFF_ROSTER',
+        'outprocessed_roster': 'OUTPROCESSED_ROSTER',
+        'open_rentals': 'OPEN_RENTALS',
+        }
+
+FILE_ID_RE = re.compile('^[0-9a-f]{64}$')
+JOB_ID_RE = re.compile('^[0-9a-f]{32}$')
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+class JobError(Exception):
+    """ raised when a job request can't be accepted; status is the http status to return """
+
+    def __init__(self, message, status=400):
+        super(JobError, self).__init__(message)
+        self.status = status
+
+
+class WorkbookCache:
+    """ a bounded cache of parsed input workbooks
+
+        Entries are keyed by the file's real path, size and modification time, so an
+        edited file is parsed again.  Only one thread parses a given file; others asking
+        for it at the same time wait for that result.
+
+        openpyxl worksheets aren't safe to read from several threads at once: reading a
+        cell that was never set adds it to the sheet, which can break another thread
+        walking the same sheet.  So each entry has a lock, and use() holds the locks of
+        all the workbooks a job needs while the job runs.  Jobs sharing an input take
+        turns; jobs with different inputs still run in parallel.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.loading = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def file_key(self, filename):
+        st = os.stat(filename)
+        return (os.path.realpath(filename), st.st_size, st.st_mtime_ns)
+
+    def load_entry(self, filename):
+        """ return the cache entry (key, workbook, lock) for filename, parsing it if needed """
+
+        key = self.file_key(filename)
+
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+
+            future = self.loading.get(key)
+            owner = future is None
+            if owner:
+                future = concurrent.futures.Future()
+                self.loading[key] = future
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if not owner:
+            return future.result()
+
+        try:
+            log.debug(f"parsing { filename }")
+            entry = (key, openpyxl.load_workbook(filename), threading.Lock())
+        except BaseException as e:
+            with self.lock:
+                del self.loading[key]
+            future.set_exception(e)
+            raise
+
+        with self.lock:
+            del self.loading[key]
+            self.entries[key] = entry
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        future.set_result(entry)
+
+        return entry
+
+    @contextlib.contextmanager
+    def use(self, filenames):
+        """ load the named files and lock them for the caller's exclusive use
+
+            Yields a load_workbook function for make_workbook that returns the locked
+            workbooks.  The locks are always taken in key order, so two jobs can't
+            deadlock waiting for each other's inputs.
+        """
+
+        entries = {}
+        for filename in filenames:
+            if filename is not None and filename not in entries:
+                entries[filename] = self.load_entry(filename)
+
+        locks = {}
+        for key, wb, lock in entries.values():
+            locks[key] = lock
+        ordered = [ locks[key] for key in sorted(locks.keys()) ]
+
+        for lock in ordered:
+            lock.acquire()
+        try:
+            yield lambda filename: entries[filename][1]
+        finally:
+            for lock in reversed(ordered):
+                lock.release()
+
+    def stats(self):
+        with self.lock:
+            return { 'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses }
+
+
+class Job:
+    def __init__(self, job_id, inputs):
+        self.id = job_id
+        self.inputs = inputs
+        self.state = 'queued'
+        self.error = None
+        self.output_file = None
+
+    def status(self):
+        result = { 'job': self.id, 'state': self.state }
+        if self.error is not None:
+            result['error'] = self.error
+        return result
+
+
+class MergeService:
+    """ owns the uploaded files, the job table, the worker pool and the workbook cache
+
+        The http handler is a thin layer over this, so the service can also be driven
+        directly.
+    """
+
+    def __init__(self, work_dir, config=None, workers=2, max_queued=8, cache_entries=16,
+            data_dir=None, keep_jobs=100, upload_ttl=3600):
+        if config is None:
+            config = merge.load_config()
+
+        self.config = config
+        self.work_dir = work_dir
+        self.data_dir = os.path.realpath(data_dir) if data_dir is not None else None
+        self.keep_jobs = keep_jobs
+        self.upload_ttl = upload_ttl
+        self.upload_dir = os.path.join(work_dir, 'uploads')
+        self.output_dir = os.path.join(work_dir, 'jobs')
+        os.makedirs(self.upload_dir, exist_ok=True)
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        self.cache = WorkbookCache(cache_entries)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='merge')
+
+        # bounds jobs that are running or waiting for a worker
+        self.slots = threading.BoundedSemaphore(workers + max_queued)
+
+        # self.lock protects the job table, the finished job list and the upload times
+        self.jobs = {}
+        self.finished = collections.deque()
+        self.upload_times = {}
+        self.lock = threading.Lock()
+
+    def add_file(self, data):
+        """ store an uploaded file; identical uploads get the same id (and share a cache entry) """
+
+        file_id = hashlib.sha256(data).hexdigest()
+        filename = self.upload_path(file_id)
+
+        with self.lock:
+            if not os.path.exists(filename):
+                fd, tmp_name = tempfile.mkstemp(dir=self.upload_dir, suffix='.tmp')
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_name, filename)
+
+            # kept in memory rather than touching the file, which would change its cache key
+            self.upload_times[filename] = time.time()
+
+        self.prune_uploads()
+
+        return file_id
+
+    def upload_path(self, file_id):
+        return os.path.join(self.upload_dir, f"{ file_id }.xlsx")
+
+    def resolve_inputs(self, request):
+        """ turn the inputs of a job request into a map from config entry to filename """
+
+        if not isinstance(request, dict):
+            raise JobError("job request must be a json object")
+
+        unknown = set(request.keys()) - set(JOB_INPUTS.keys())
+        if unknown:
+            raise JobError(f"unknown job inputs: { ', '.join(sorted(unknown)) }")
+
+        if 'vehicles' not in request:
+            raise JobError("job request must include vehicles")
+
+        inputs = {}
+        for name, config_key in JOB_INPUTS.items():
+            if name not in request:
+                inputs[config_key] = None
+                continue
+
+            ref = request[name]
+            if not isinstance(ref, dict) or len(ref) != 1:
+                raise JobError(f"input { name } must be {{ \"file\": id }} or {{ \"path\": filename }}")
+
+            if 'file' in ref:
+                file_id = ref['file']
+                if not isinstance(file_id, str) or not FILE_ID_RE.match(file_id):
+                    raise JobError(f"input { name }: bad file id")
+                filename = self.upload_path(file_id)
+            elif 'path' in ref:
+                filename = self.data_path(name, ref['path'])
+            else:
+                raise JobError(f"input { name } must be {{ \"file\": id }} or {{ \"path\": filename }}")
+
+            if not os.path.isfile(filename):
+                raise JobError(f"input { name } not found")
+
+            inputs[config_key] = filename
+
+        # the outprocessed tab is normally generated from the staff roster
+        if inputs['OUTPROCESSED_ROSTER'] is None:
+            inputs['OUTPROCESSED_ROSTER'] = inputs['STAFF_ROSTER']
+
+        return inputs
+
+    def data_path(self, name, path):
+        """ resolve a path input, which must name a file under the data directory """
+
+        if self.data_dir is None:
+            raise JobError(f"input { name }: path inputs are not enabled on this server", status=403)
+
+        if not isinstance(path, str):
+            raise JobError(f"input { name }: bad path")
+
+        filename = os.path.realpath(os.path.join(self.data_dir, path))
+        if os.path.commonpath([ self.data_dir, filename ]) != self.data_dir:
+            raise JobError(f"input { name }: path is outside the data directory", status=403)
+
+        return filename
+
+    def submit(self, request):
+        """ validate a job request and queue it; returns the new job """
+
+        if not self.slots.acquire(blocking=False):
+            raise JobError("too many jobs queued; try again later", status=503)
+
+        try:
+            # resolve and register together, so prune_uploads can't remove an input in between
+            with self.lock:
+                inputs = self.resolve_inputs(request)
+                job = Job(uuid.uuid4().hex, inputs)
+                self.jobs[job.id] = job
+        except BaseException:
+            self.slots.release()
+            raise
+
+        try:
+            self.executor.submit(self.run_job, job)
+        except BaseException:
+            self.slots.release()
+            raise
+
+        return job
+
+    def run_job(self, job):
+        try:
+            job.state = 'running'
+            log.info(f"job { job.id }: starting")
+
+            config = merge.AttrDict(self.config)
+            config.update(job.inputs)
+
+            output_file = os.path.join(self.output_dir, f"{ job.id }.xlsx")
+            with self.cache.use(job.inputs.values()) as load_workbook:
+                merge.make_workbook(config, output_file, load_workbook=load_workbook)
+
+            job.output_file = output_file
+            job.state = 'done'
+            log.info(f"job { job.id }: done")
+        except merge.InputError as e:
+            job.error = str(e)
+            job.state = 'failed'
+            log.info(f"job { job.id }: failed: { e }")
+        except Exception as e:
+            job.error = f"internal error: { e }"
+            job.state = 'failed'
+            log.exception(f"job { job.id }: failed")
+        finally:
+            self.slots.release()
+            self.retire_jobs(job)
+
+    def retire_jobs(self, job):
+        """ add job to the finished list, and forget the oldest finished jobs past keep_jobs """
+
+        retired = []
+        with self.lock:
+            self.finished.append(job.id)
+            while len(self.finished) > self.keep_jobs:
+                old_job = self.jobs.pop(self.finished.popleft())
+                retired.append(old_job)
+
+        for old_job in retired:
+            log.debug(f"job { old_job.id }: retired")
+            if old_job.output_file is not None and os.path.exists(old_job.output_file):
+                os.remove(old_job.output_file)
+
+        if retired:
+            self.prune_uploads()
+
+    def prune_uploads(self):
+        """ delete uploads that no kept job uses and that weren't uploaded within upload_ttl """
+
+        cutoff = time.time() - self.upload_ttl
+
+        with self.lock:
+            in_use = set()
+            for job in self.jobs.values():
+                in_use.update(job.inputs.values())
+
+            for entry in os.scandir(self.upload_dir):
+                filename = entry.path
+                if not filename.endswith('.xlsx') or filename in in_use:
+                    continue
+
+                uploaded = self.upload_times.get(filename)
+                if uploaded is None:
+                    # left over from an earlier run of the service
+                    uploaded = entry.stat().st_mtime
+                if uploaded > cutoff:
+                    continue
+
+                log.debug(f"removing upload { filename }")
+                os.remove(filename)
+                self.upload_times.pop(filename, None)
+
+    def get_job(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    """ maps the http api onto the MergeService in server.service """
+
+    protocol_version = 'HTTP/1.1'
+
+    # uploads bigger than this are refused
+    max_upload = 64 * 1024 * 1024
+
+    # the connection is kept open between requests, so every reply must come after the
+    # request body has been read (or the connection is closed); otherwise the unread body
+    # would be taken as the next request
+
+    def do_PUT(self):
+        data = self.read_body()
+        if data is None:
+            return
+
+        if self.path != '/files':
+            return self.send_json(404, { 'error': 'not found' })
+
+        file_id = self.server.service.add_file(data)
+        self.send_json(201, { 'file': file_id })
+
+    def do_POST(self):
+        data = self.read_body()
+        if data is None:
+            return
+
+        if self.path != '/jobs':
+            return self.send_json(404, { 'error': 'not found' })
+
+        try:
+            request = json.loads(data)
+        except ValueError:
+            return self.send_json(400, { 'error': 'job request is not valid json' })
+
+        try:
+            job = self.server.service.submit(request)
+        except JobError as e:
+            return self.send_json(e.status, { 'error': str(e) })
+
+        self.send_json(202, job.status())
+
+    def do_GET(self):
+        # a GET shouldn't have a body, but if it does it has to be read
+        if 'Content-Length' in self.headers or 'Transfer-Encoding' in self.headers:
+            if self.read_body() is None:
+                return
+
+        parts = self.path.strip('/').split('/')
+
+        if parts == [ 'status' ]:
+            return self.send_json(200, { 'cache': self.server.service.cache.stats() })
+
+        if len(parts) not in (2, 3) or parts[0] != 'jobs' or not JOB_ID_RE.match(parts[1]):
+            return self.send_json(404, { 'error': 'not found' })
+
+        job = self.server.service.get_job(parts[1])
+        if job is None:
+            return self.send_json(404, { 'error': 'no such job' })
+
+        if len(parts) == 2:
+            return self.send_json(200, job.status())
+
+        if parts[2] != 'workbook':
+            return self.send_json(404, { 'error': 'not found' })
+
+        if job.state != 'done':
+            return self.send_json(409, job.status())
+
+        # the job may have been retired (and its workbook deleted) since get_job
+        try:
+            with open(job.output_file, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return self.send_json(404, { 'error': 'no such job' })
+
+        self.send_response(200)
+        self.send_header('Content-Type', XLSX_CONTENT_TYPE)
+        self.send_header('Content-Disposition', 'attachment; filename="merged.xlsx"')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_body(self):
+        """ read the request body; sends an error response and returns None if it can't
+
+            The body is left unread in that case, so the connection is closed.
+        """
+
+        if 'Transfer-Encoding' in self.headers:
+            self.send_json(411, { 'error': 'Content-Length required' }, close=True)
+            return None
+
+        try:
+            length = int(self.headers.get('Content-Length', ''))
+        except ValueError:
+            self.send_json(411, { 'error': 'Content-Length required' }, close=True)
+            return None
+
+        if length < 0 or length > self.max_upload:
+            self.send_json(413, { 'error': 'request body too large' }, close=True)
+            return None
+
+        return self.rfile.read(length)
+
+    def send_json(self, status, body, close=False):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        if close:
+            # also sets self.close_connection
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        log.debug(f"{ self.address_string() } { format % args }")
+
+
+def make_server(service, host='127.0.0.1', port=0):
+    """ build (but don't start) an http server for service; port 0 picks a free port """
+
+    server = http.server.ThreadingHTTPServer((host, port), RequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+def main():
+    args = parse_args()
+    init_logging.init_logging(__name__)
+    if args.debug:
+        logging.getLogger().setLevel(logging.DEBUG)
+
+    work_dir = args.work_dir
+    if work_dir is None:
+        work_dir = tempfile.mkdtemp(prefix='arc-merge-')
+
+    service = MergeService(work_dir, workers=args.workers, max_queued=args.max_queued, cache_entries=args.cache_entries,
+            data_dir=args.data_dir, keep_jobs=args.keep_jobs, upload_ttl=args.upload_ttl)
+    server = make_server(service, args.host, args.port)
+
+    host, port = server.server_address[:2]
+    log.info(f"serving on http://{ host }:{ port }/ (work dir { work_dir })")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+            description="serve merged workbook generation over a local http api",
+            allow_abbrev=False)
+    parser.add_argument("--debug", help="turn on debugging output", action="store_true")
+    parser.add_argument("--host", help="address to listen on", default="127.0.0.1")
+    parser.add_argument("--port", help="port to listen on", type=int, default=8534)
+    parser.add_argument("--workers", help="number of jobs to run at once", type=int, default=2)
+    parser.add_argument("--max-queued", help="number of jobs that may wait for a worker", type=int, default=8)
+    parser.add_argument("--cache-entries", help="number of parsed input workbooks to keep", type=int, default=16)
+    parser.add_argument("--work-dir", help="where to keep uploads and outputs (default: a temporary directory)")
+    parser.add_argument("--data-dir", help="directory that job path inputs may read from (default: path inputs are refused)")
+    parser.add_argument("--keep-jobs", help="number of finished jobs (and their workbooks) to keep", type=int, default=100)
+    parser.add_argument("--upload-ttl", help="seconds to keep an upload that no kept job uses", type=int, default=3600)
+
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    main()
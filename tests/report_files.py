@@ -0,0 +1,60 @@
+""" small generated versions of the reports the tool reads """
+
+import datetime
+
+import openpyxl
+
+
+VEHICLES_TITLE = [ 'Ctg', 'Key', 'Rcvd From', 'Driver', 'Status', 'Reservation No', 'GAP', 'Date Received',
+        'Make', 'Model', 'Color', 'Plate', 'Tag' ]
+
+STAFF_TITLE = [ 'Name', 'Email', 'Cell phone', 'Assigned', 'Checked in', 'Current/Last Supervisor', 'Released' ]
+
+RENTALS_TITLE = [ None, 'MVA No', 'License Plate Number', 'Reservation No', 'Cost Control No', 'Full Name', 'CO Date' ]
+
+
+def write_vehicles(filename, extra_rows=0):
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = 'Sheet1'
+    ws.append(VEHICLES_TITLE)
+    ws.append([ 'R', '', 'Smith, Ann', 'Smith, Ann', 'Active', 'RES1', 'G1', datetime.datetime(2020, 9, 1),
+        'Ford', 'Fusion', 'Blue', 'ABC123', 'T1' ])
+    ws.append([ 'R', '', 'Jones, Bob', 'Jones, Bob', 'Active', 'RES2', 'G2', datetime.datetime(2020, 9, 2),
+        'Kia', 'Soul', 'Red', 'XYZ789', 'T2' ])
+    ws.append([ 'R', '1234', 'Lee, Cal', 'Lee, Cal', 'Active', 'RES3', 'G3', datetime.datetime(2020, 9, 3),
+        'Jeep', 'Compass', 'White', 'LMN456', 'T3' ])
+    for i in range(extra_rows):
+        ws.append([ 'R', '', f"Extra, { i }", f"Extra, { i }", 'Active', f"XRES{ i }", '', None,
+            '', '', '', f"X{ i }", '' ])
+    wb.save(filename)
+
+
+def write_staff_roster(filename):
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = 'Staff Roster'
+    for i in range(5):
+        ws.append([ 'header' ])
+    ws.append(STAFF_TITLE)
+    ws.append([ 'Smith, Ann', 'ann@example.org', '555-0101', 'LOG', '2020-08-30', 'Boss, Big', None ])
+    ws.append([ 'Lee, Cal', 'cal@example.org', '555-0103', 'LOG', '2020-08-31', 'Boss, Big', '2020-09-20' ])
+    wb.save(filename)
+
+
+def write_open_rentals(filename):
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = 'Open RA'
+    ws.append([ 'report' ])
+    ws.append([ 'date' ])
+    ws.append(RENTALS_TITLE)
+    ws.append([ None, '1234', 'LMN456', 'RES-3', '534', 'Lee, Cal', datetime.datetime(2020, 9, 3) ])
+    ws.append([ None, '9999', 'ABC123', 'RES-9', '534', 'Smith, Ann', datetime.datetime(2020, 9, 1) ])
+    ws.append([ None, '8888', 'QQQ111', 'RES-8', '999', 'Other, Dr', datetime.datetime(2020, 9, 1) ])
+    wb.save(filename)
+
+
+def sheet_values(filename):
+    wb = openpyxl.load_workbook(filename)
+    return { name: [ list(row) for row in wb[name].iter_rows(values_only=True) ] for name in wb.sheetnames }
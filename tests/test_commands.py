@@ -0,0 +1,177 @@
+""" the check, counts and dump commands, and the table cache behind them """
+
+import os
+import sys
+import glob
+import shutil
+import argparse
+import subprocess
+
+import openpyxl
+import pytest
+
+import main
+
+from report_files import write_vehicles, write_open_rentals
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def config(tmp_path):
+    """ vehicles and an Avis report with only the open rentals sheet; no staff roster """
+
+    vehicles = str(tmp_path / 'Vehicles.xlsx')
+    open_rentals = str(tmp_path / 'open_rentals.xlsx')
+    write_vehicles(vehicles)
+    write_open_rentals(open_rentals)
+
+    config = main.load_config()
+    config.update({
+            'VEHICLES': vehicles,
+            'STAFF_ROSTER': str(tmp_path / 'no_staff_roster.xlsx'),
+            'OUTPROCESSED_ROSTER': str(tmp_path / 'no_staff_roster.xlsx'),
+            'OPEN_RENTALS': open_rentals,
+            'CLOSED_RENTALS': open_rentals,
+            'CACHE_DIR': str(tmp_path / 'cache'),
+            })
+    return config
+
+
+def cache_files(config):
+    return sorted(glob.glob(os.path.join(config.CACHE_DIR, '*.json')))
+
+
+def output_lines(capsys):
+    return capsys.readouterr().out.splitlines()
+
+
+def test_check(config, capsys):
+    assert main.command_check(config, argparse.Namespace()) == 0
+    lines = output_lines(capsys)
+    assert lines[0].startswith('vehicles\tok\t')
+    assert lines[1].startswith('staff_roster\tmissing\t')
+    assert lines[3].startswith('open_rentals\tok\t')
+    assert lines[4].startswith('closed_rentals\tmissing sheet Closed RA\t')
+
+    config.VEHICLES_SHEET_NAME = 'Nope'
+    assert main.command_check(config, argparse.Namespace()) == 1
+    assert output_lines(capsys)[0].startswith('vehicles\tmissing sheet Nope\t')
+
+    os.remove(config.VEHICLES)
+    assert main.command_check(config, argparse.Namespace()) == 1
+    assert output_lines(capsys)[0].startswith('vehicles\tmissing\t')
+
+
+def test_counts(config, capsys):
+    assert main.command_counts(config, argparse.Namespace(no_cache=False)) == 0
+    assert output_lines(capsys) == [
+            'vehicles\t3',
+            'staff_roster\t-',
+            'outprocessed_roster\t-',
+            'open_rentals\t3',
+            'closed_rentals\tmissing sheet',
+            ]
+
+
+def test_dump(config, capsys):
+    assert main.command_dump(config, argparse.Namespace(table='vehicles', no_cache=False)) == 0
+    lines = output_lines(capsys)
+    assert len(lines) == 4
+    assert lines[0].split('\t')[:3] == [ 'Ctg', 'Key', 'Rcvd From' ]
+    assert lines[3].split('\t')[:3] == [ 'R', '1234', 'Lee, Cal' ]
+
+    assert main.command_dump(config, argparse.Namespace(table='closed_rentals', no_cache=False)) == 1
+    assert main.command_dump(config, argparse.Namespace(table='staff_roster', no_cache=False)) == 1
+    assert output_lines(capsys) == []
+
+
+def test_cache_hit_matches_miss(config, monkeypatch):
+    missed = main.read_table(config, 'vehicles')
+    assert len(cache_files(config)) == 1
+
+    # the second read must come from the cache
+    def no_parse(*args):
+        raise AssertionError("parsed the workbook on a cache hit")
+    monkeypatch.setattr(main, 'parse_table', no_parse)
+
+    assert main.read_table(config, 'vehicles') == missed
+    title, rows = missed
+    assert title[:3] == [ 'Ctg', 'Key', 'Rcvd From' ]
+    assert len(rows) == 3
+    # dates come back as strings either way
+    assert rows[0][7] == '2020-09-01 00:00:00'
+
+
+def test_changed_file_replaces_cache_entry(config):
+    title, rows = main.read_table(config, 'vehicles')
+    assert len(rows) == 3
+    [ old_cache ] = cache_files(config)
+
+    # new contents and a different mtime
+    write_vehicles(config.VEHICLES, extra_rows=2)
+    st = os.stat(config.VEHICLES)
+    os.utime(config.VEHICLES, ns=(st.st_atime_ns, st.st_mtime_ns + 1000000000))
+
+    title, rows = main.read_table(config, 'vehicles')
+    assert len(rows) == 5
+    [ new_cache ] = cache_files(config)
+    assert new_cache != old_cache
+
+
+def test_no_cache_skips_cache(config, capsys):
+    main.read_table(config, 'vehicles', use_cache=False)
+    assert cache_files(config) == []
+
+    # plant a cache entry with the wrong contents; --no-cache must not read (or replace) it
+    main.read_table(config, 'vehicles')
+    [ cache_file ] = cache_files(config)
+    with open(cache_file, 'w') as f:
+        f.write('{ "title": [ "stale" ], "rows": [] }')
+
+    assert main.read_table(config, 'vehicles') == ([ 'stale' ], [])
+    title, rows = main.read_table(config, 'vehicles', use_cache=False)
+    assert len(rows) == 3
+
+    main.command_counts(config, argparse.Namespace(no_cache=True))
+    assert 'vehicles\t3' in output_lines(capsys)
+    with open(cache_file) as f:
+        assert 'stale' in f.read()
+
+
+def test_missing_sheet_is_cached(config, monkeypatch):
+    with pytest.raises(main.MissingSheetError):
+        main.read_table(config, 'closed_rentals')
+
+    def no_parse(*args):
+        raise AssertionError("parsed the workbook on a cache hit")
+    monkeypatch.setattr(main, 'parse_table', no_parse)
+
+    with pytest.raises(main.MissingSheetError):
+        main.read_table(config, 'closed_rentals')
+
+
+def test_dump_into_closed_pipe(tmp_path):
+    # run from a copy of the scripts, so config.py's paths find the report in tmp_path
+    for filename in glob.glob(os.path.join(REPO_DIR, '*.py')):
+        shutil.copy(filename, tmp_path)
+
+    # big enough that dump is still writing when the reader goes away
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = 'Sheet1'
+    ws.append([ 'Ctg', 'Key', 'Rcvd From' ])
+    for i in range(5000):
+        ws.append([ 'R', '', f"Driver number { i } " * 10 ])
+    wb.save(str(tmp_path / 'Vehicles.xlsx'))
+
+    proc = subprocess.Popen([ sys.executable, 'main.py', 'dump', 'vehicles' ], cwd=str(tmp_path),
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    assert proc.stdout.readline().startswith(b'Ctg\t')
+    proc.stdout.close()
+    stderr = proc.stderr.read()
+    proc.stderr.close()
+
+    assert proc.wait(timeout=60) == 0
+    assert b'Traceback' not in stderr
@@ -0,0 +1,275 @@
+""" exercise the merge service over http with small generated reports """
+
+import os
+import json
+import time
+import socket
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+import main as merge
+import service
+
+from report_files import write_vehicles, write_staff_roster, write_open_rentals, sheet_values
+
+
+@pytest.fixture
+def reports(tmp_path):
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir()
+    files = {
+            'vehicles': str(data_dir / 'Vehicles.xlsx'),
+            'staff_roster': str(data_dir / 'staff_roster.xlsx'),
+            'open_rentals': str(data_dir / 'open_rentals.xlsx'),
+            }
+    write_vehicles(files['vehicles'])
+    write_staff_roster(files['staff_roster'])
+    write_open_rentals(files['open_rentals'])
+    return str(data_dir), files
+
+
+@pytest.fixture
+def make_service(tmp_path, reports):
+    """ returns a function that starts a service with the given options; the servers are stopped afterwards """
+
+    data_dir, files = reports
+    running = []
+
+    def start(**kwargs):
+        kwargs.setdefault('data_dir', data_dir)
+        svc = service.MergeService(str(tmp_path / f"work{ len(running) }"), config=merge.load_config(), **kwargs)
+        server = service.make_server(svc, port=0)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        running.append((svc, server))
+        return svc, Client(f"http://127.0.0.1:{ server.server_address[1] }")
+
+    yield start
+
+    for svc, server in running:
+        server.shutdown()
+        server.server_close()
+        svc.shutdown()
+
+
+class Client:
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.port = int(base_url.rsplit(':', 1)[1])
+
+    def raw(self, data):
+        """ send data on a new connection, and return everything the server sends back before it closes """
+        with socket.create_connection(('127.0.0.1', self.port), timeout=30) as sock:
+            sock.sendall(data)
+            sock.shutdown(socket.SHUT_WR)
+            chunks = []
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        return b''.join(chunks)
+
+    def request(self, method, path, data=None):
+        """ returns the http status and the response body """
+        request = urllib.request.Request(self.base_url + path, data=data, method=method)
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def json(self, method, path, body=None):
+        data = None
+        if body is not None:
+            data = body if isinstance(body, bytes) else json.dumps(body).encode('utf-8')
+        status, result = self.request(method, path, data)
+        return status, json.loads(result)
+
+    def upload(self, filename):
+        with open(filename, 'rb') as f:
+            status, result = self.json('PUT', '/files', f.read())
+        assert status == 201
+        return result['file']
+
+    def wait(self, job_id):
+        deadline = time.time() + 30
+        while time.time() < deadline:
+            status, result = self.json('GET', f"/jobs/{ job_id }")
+            assert status == 200
+            if result['state'] in ('done', 'failed'):
+                return result
+            time.sleep(0.05)
+        raise AssertionError(f"job { job_id } didn't finish")
+
+
+def test_job_matches_direct_run(tmp_path, reports, make_service):
+    data_dir, files = reports
+    svc, client = make_service()
+
+    request = {
+            'vehicles': { 'file': client.upload(files['vehicles']) },
+            'staff_roster': { 'file': client.upload(files['staff_roster']) },
+            'open_rentals': { 'path': 'open_rentals.xlsx' },
+            }
+    status, result = client.json('POST', '/jobs', request)
+    assert status == 202
+    assert client.wait(result['job'])['state'] == 'done'
+
+    status, data = client.request('GET', f"/jobs/{ result['job'] }/workbook")
+    assert status == 200
+    served_file = str(tmp_path / 'served.xlsx')
+    with open(served_file, 'wb') as f:
+        f.write(data)
+
+    config = merge.load_config()
+    config.update({ 'VEHICLES': files['vehicles'], 'STAFF_ROSTER': files['staff_roster'],
+        'OUTPROCESSED_ROSTER': files['staff_roster'], 'OPEN_RENTALS': files['open_rentals'] })
+    direct_file = str(tmp_path / 'direct.xlsx')
+    merge.make_workbook(config, direct_file)
+
+    served = sheet_values(served_file)
+    assert served == sheet_values(direct_file)
+    assert config.RECONCILED_SHEET_NAME in served
+    assert config.MERGED_SHEET_NAME in served
+
+
+def test_cache_reuses_parsed_inputs(reports, make_service):
+    data_dir, files = reports
+    svc, client = make_service()
+
+    # outprocessed_roster defaults to the same file as staff_roster, so two files are parsed
+    request = { 'vehicles': { 'file': client.upload(files['vehicles']) }, 'staff_roster': { 'path': 'staff_roster.xlsx' } }
+    for expected in [ { 'entries': 2, 'hits': 0, 'misses': 2 }, { 'entries': 2, 'hits': 2, 'misses': 2 } ]:
+        status, result = client.json('POST', '/jobs', request)
+        assert status == 202
+        assert client.wait(result['job'])['state'] == 'done'
+
+        status, result = client.json('GET', '/status')
+        assert status == 200
+        assert result['cache'] == expected
+
+
+def test_bad_requests(reports, make_service):
+    data_dir, files = reports
+    svc, client = make_service()
+    vehicles = { 'file': client.upload(files['vehicles']) }
+
+    status, result = client.json('POST', '/jobs', b'{ not json')
+    assert status == 400
+
+    status, result = client.json('POST', '/jobs', { 'vehicles': vehicles, 'fuel': vehicles })
+    assert status == 400
+    assert 'fuel' in result['error']
+
+    status, result = client.json('POST', '/jobs', { 'staff_roster': { 'path': 'staff_roster.xlsx' } })
+    assert status == 400
+
+    status, result = client.json('POST', '/jobs', { 'vehicles': { 'file': '0' * 64 } })
+    assert status == 400
+
+    status, result = client.json('GET', f"/jobs/{ '0' * 32 }")
+    assert status == 404
+    status, result = client.json('GET', '/nowhere')
+    assert status == 404
+    status, result = client.json('PUT', '/nowhere', b'')
+    assert status == 404
+
+
+def test_unread_body_is_not_a_request(make_service):
+    svc, client = make_service()
+
+    # the body of a request to a bad path must be read, not run as the next request
+    inner = b'GET /status HTTP/1.1\r\nHost: localhost\r\n\r\n'
+    reply = client.raw(b'PUT /nowhere HTTP/1.1\r\nHost: localhost\r\nContent-Length: ' +
+            str(len(inner)).encode('ascii') + b'\r\n\r\n' + inner)
+    assert reply.startswith(b'HTTP/1.1 404')
+    assert reply.count(b'HTTP/1.1 ') == 1
+
+    # a body that is too big is left unread, so the server closes the connection
+    reply = client.raw(b'PUT /files HTTP/1.1\r\nHost: localhost\r\nContent-Length: 1000000000\r\n\r\n')
+    assert reply.startswith(b'HTTP/1.1 413')
+    assert b'Connection: close' in reply
+    assert reply.count(b'HTTP/1.1 ') == 1
+
+
+def test_path_inputs_stay_in_data_dir(tmp_path, reports, make_service):
+    data_dir, files = reports
+    outside = str(tmp_path / 'outside.xlsx')
+    write_vehicles(outside)
+
+    svc, client = make_service()
+    for path in [ '../outside.xlsx', outside ]:
+        status, result = client.json('POST', '/jobs', { 'vehicles': { 'path': path } })
+        assert status == 403
+
+    svc, client = make_service(data_dir=None)
+    status, result = client.json('POST', '/jobs', { 'vehicles': { 'path': 'Vehicles.xlsx' } })
+    assert status == 403
+
+
+def test_queue_full_and_not_ready(reports, make_service):
+    data_dir, files = reports
+    svc, client = make_service(workers=1, max_queued=0)
+    request = { 'vehicles': { 'path': 'Vehicles.xlsx' } }
+
+    # hold the vehicles workbook so the first job can't finish
+    key, wb, lock = svc.cache.load_entry(os.path.join(data_dir, 'Vehicles.xlsx'))
+    with lock:
+        status, first = client.json('POST', '/jobs', request)
+        assert status == 202
+
+        status, result = client.json('POST', '/jobs', request)
+        assert status == 503
+
+        status, result = client.json('GET', f"/jobs/{ first['job'] }/workbook")
+        assert status == 409
+        assert result['state'] in ('queued', 'running')
+
+    # staff roster and avis file are both missing
+    result = client.wait(first['job'])
+    assert result['state'] == 'failed'
+    assert 'Neither' in result['error']
+
+    status, result = client.json('GET', f"/jobs/{ first['job'] }/workbook")
+    assert status == 409
+
+
+def test_old_jobs_and_uploads_are_removed(tmp_path, reports, make_service):
+    data_dir, files = reports
+    svc, client = make_service(keep_jobs=1)
+
+    other_vehicles = str(tmp_path / 'other_vehicles.xlsx')
+    write_vehicles(other_vehicles, extra_rows=2)
+
+    first_upload = client.upload(files['vehicles'])
+    second_upload = client.upload(other_vehicles)
+
+    jobs = []
+    for upload in [ first_upload, second_upload ]:
+        status, result = client.json('POST', '/jobs', { 'vehicles': { 'file': upload }, 'staff_roster': { 'path': 'staff_roster.xlsx' } })
+        assert status == 202
+        assert client.wait(result['job'])['state'] == 'done'
+        jobs.append(result['job'])
+
+    # only the newest job is kept
+    status, result = client.json('GET', f"/jobs/{ jobs[0] }")
+    assert status == 404
+    assert not os.path.exists(os.path.join(svc.output_dir, f"{ jobs[0] }.xlsx"))
+    status, data = client.request('GET', f"/jobs/{ jobs[1] }/workbook")
+    assert status == 200
+
+    # a workbook deleted between looking up the job and reading the file is a 404
+    os.remove(os.path.join(svc.output_dir, f"{ jobs[1] }.xlsx"))
+    status, result = client.json('GET', f"/jobs/{ jobs[1] }/workbook")
+    assert status == 404
+
+    # the unused upload goes once its time is up; the one the kept job uses stays
+    assert os.path.exists(svc.upload_path(first_upload))
+    svc.upload_ttl = 0
+    svc.prune_uploads()
+    assert not os.path.exists(svc.upload_path(first_upload))
+    assert os.path.exists(svc.upload_path(second_upload))